@@ -3,23 +3,33 @@ patch_chromadb_telemetry()
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer
 import os
-import shutil
-from typing import List, Optional
+import asyncio
+import hashlib
+import aiofiles
+import anyio
+import orjson
+from typing import List, Dict, Optional
 import uuid
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
 from app.models import *
 from app.services.document_processor import DocumentProcessor
 from app.services.embeddings import EmbeddingService
 from app.services.qa_engine import QAEngine
+from app.services.query_cache import QueryCache
 from app.services.auth import auth_service, get_current_user, get_current_user_optional
 from app.services.database import db_service
 
 # Initialize FastAPI app
-app = FastAPI(title="Document QA System", version="1.0.0")
+app = FastAPI(
+    title="Document QA System",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # CORS middleware
 app.add_middleware(
@@ -34,6 +44,7 @@ app.add_middleware(
 doc_processor = DocumentProcessor()
 embedding_service = EmbeddingService()
 qa_engine = QAEngine()
+query_cache = QueryCache()
 
 # Database collections
 documents_collection = None
@@ -42,10 +53,39 @@ chat_history_collection = None
 # Create uploads directory
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB read size when streaming uploads
 
 # JWT settings
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Fields needed to build DocumentMetadata
+DOCUMENT_LIST_PROJECTION = {
+    "_id": 0,
+    "doc_id": 1,
+    "filename": 1,
+    "upload_time": 1,
+    "total_pages": 1,
+    "metadata.total_chunks": 1,
+    "metadata.summary": 1,
+    "metadata.key_topics": 1,
+    "metadata.estimated_reading_time": 1,
+    "metadata.complexity_score": 1
+}
+# Documents read before /api/documents commits to a response; longer lists stream
+DOCUMENT_LIST_PREFETCH = 100
+
+async def search_chunks(question: str, doc_ids: List[str], top_k: int) -> List[Dict]:
+    """Vector search through the query cache, off the event loop"""
+    cache_key = QueryCache.make_key(doc_ids, question, top_k)
+    chunks = query_cache.get(cache_key)
+    if chunks is None:
+        chunks = await asyncio.to_thread(
+            embedding_service.search_similar, question, doc_ids=doc_ids, top_k=top_k
+        )
+        if chunks:
+            query_cache.put(cache_key, chunks)
+    return chunks
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
@@ -59,6 +99,9 @@ async def startup_event():
         documents_collection = db_service.get_collection("documents")
         chat_history_collection = db_service.get_collection("chat_history")
         
+        # Worker processes for CPU-bound document parsing
+        app.state.pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+        
         print("🚀 Application started successfully")
     except Exception as e:
         print(f"❌ Failed to start application: {e}")
@@ -69,6 +112,8 @@ async def startup_event():
 async def shutdown_event():
     """Clean up on shutdown"""
     await db_service.disconnect()
+    if getattr(app.state, "pool", None):
+        app.state.pool.shutdown(wait=False, cancel_futures=True)
     print("🛑 Application shutdown complete")
 
 @app.get("/")
@@ -141,25 +186,69 @@ async def upload_document(
         if not file.filename.endswith(('.pdf', '.txt')):
             raise HTTPException(400, "Only PDF and TXT files are supported")
         
-        # Check file size (50MB limit)
+        # Stream to disk, enforcing the 50MB limit as chunks arrive
         MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB in bytes
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(400, f"File size exceeds 50MB limit. Current size: {len(file_content) / (1024*1024):.1f}MB")
+        file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}_{file.filename}")
+        total_size = 0
+        content_hash = hashlib.sha256()
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                total_size += len(chunk)
+                if total_size > MAX_FILE_SIZE:
+                    break
+                content_hash.update(chunk)
+                await buffer.write(chunk)
         
-        # Reset file pointer for processing
-        await file.seek(0)
+        if total_size > MAX_FILE_SIZE:
+            await anyio.to_thread.run_sync(os.remove, file_path)
+            raise HTTPException(400, "File size exceeds 50MB limit")
         
-        # Save file
-        file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}_{file.filename}")
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Skip reprocessing if this user already uploaded identical content
+        # and its chunks are still searchable
+        content_sha256 = content_hash.hexdigest()
+        existing = await documents_collection.find_one(
+            {"user_id": current_user.id, "content_sha256": content_sha256},
+            {"doc_id": 1, "file_path": 1, "metadata": 1}
+        )
+        if existing and existing["doc_id"] not in embedding_service.index:
+            # Stale record (embedding failed or the vector store was wiped):
+            # drop it and its leftovers, then process this upload from scratch
+            print(f"⚠️  Re-processing {file.filename}: stored chunks for {existing['doc_id'][:8]} are missing")
+            embedding_service.delete_document(existing["doc_id"])
+            query_cache.invalidate(existing["doc_id"])
+            stale_path = existing.get("file_path")
+            if stale_path and await anyio.to_thread.run_sync(os.path.exists, stale_path):
+                await anyio.to_thread.run_sync(os.remove, stale_path)
+            await documents_collection.delete_one({
+                "doc_id": existing["doc_id"],
+                "user_id": current_user.id
+            })
+            existing = None
+        if existing:
+            await anyio.to_thread.run_sync(os.remove, file_path)
+            return DocumentUploadResponse(
+                doc_id=existing["doc_id"],
+                filename=file.filename,
+                total_chunks=existing["metadata"]["total_chunks"],
+                file_size=total_size,
+                summary=existing["metadata"]["summary"],
+                key_topics=existing["metadata"]["key_topics"],
+                estimated_reading_time=existing["metadata"]["estimated_reading_time"],
+                complexity_score=existing["metadata"]["complexity_score"]
+            )
         
-        # Process document
-        result = await doc_processor.process_document(file_path, file.filename)
+        loop = asyncio.get_running_loop()
         
-        # Embed chunks
-        embedding_service.embed_chunks(result["chunks"], result["doc_id"])
+        # Process document in a worker process
+        result = await loop.run_in_executor(
+            app.state.pool, doc_processor.process_document_sync, file_path, file.filename
+        )
+        
+        # Embed chunks in a thread; the vector store lives in this process
+        await loop.run_in_executor(
+            None, embedding_service.embed_chunks, result["chunks"], result["doc_id"]
+        )
+        query_cache.invalidate(result["doc_id"])
         
         # Store document in MongoDB
         document_doc = {
@@ -167,6 +256,7 @@ async def upload_document(
             "user_id": current_user.id,
             "filename": result["filename"],
             "file_path": file_path,
+            "content_sha256": content_sha256,
             "upload_time": datetime.utcnow(),
             "total_pages": result["total_pages"],
             "metadata": result["metadata"]
@@ -178,44 +268,52 @@ async def upload_document(
             doc_id=result["doc_id"],
             filename=result["filename"],
             total_chunks=result["metadata"]["total_chunks"],
-            file_size=os.path.getsize(file_path),
+            file_size=total_size,
             summary=result["metadata"]["summary"],
             key_topics=result["metadata"]["key_topics"],
             estimated_reading_time=result["metadata"]["estimated_reading_time"],
             complexity_score=result["metadata"]["complexity_score"]
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, f"Error processing document: {str(e)}")
 
+async def retrieve_for_question(request: QuestionRequest, current_user: User):
+    """Check document ownership and retrieve chunks; returns (chunks, question embedding)"""
+    # Validate documents exist and belong to user
+    found_ids = await documents_collection.distinct("doc_id", {
+        "doc_id": {"$in": request.doc_ids},
+        "user_id": current_user.id
+    })
+    missing = set(request.doc_ids) - set(found_ids)
+    if missing:
+        raise HTTPException(404, f"Document {sorted(missing)[0]} not found")
+    
+    # Search for relevant chunks (served from cache for repeated questions)
+    relevant_chunks = await search_chunks(request.question, request.doc_ids, top_k=10)
+    
+    if not relevant_chunks:
+        raise HTTPException(404, "No relevant information found")
+    
+    # The question embedding (cached from the search) lets rephrased
+    # questions over the same chunks reuse an earlier answer
+    question_embedding = await asyncio.to_thread(embedding_service.embed_query_cached, request.question)
+    return relevant_chunks, question_embedding
+
 @app.post("/api/ask", response_model=Answer)
 async def ask_question(request: QuestionRequest, current_user: User = Depends(get_current_user)):
     """Ask a question about uploaded documents"""
     try:
-        # Validate documents exist and belong to user
-        for doc_id in request.doc_ids:
-            doc_doc = await documents_collection.find_one({
-                "doc_id": doc_id,
-                "user_id": current_user.id
-            })
-            if not doc_doc:
-                raise HTTPException(404, f"Document {doc_id} not found")
-        
-        # Search for relevant chunks
-        relevant_chunks = embedding_service.search_similar(
-            request.question,
-            doc_ids=request.doc_ids,
-            top_k=10
-        )
-        
-        if not relevant_chunks:
-            raise HTTPException(404, "No relevant information found")
+        relevant_chunks, question_embedding = await retrieve_for_question(request, current_user)
         
         # Generate answer
-        result = qa_engine.generate_answer(
+        result = await qa_engine.generate_answer_async(
             request.question,
             relevant_chunks,
-            request.conversation_history
+            request.conversation_history,
+            question_embedding=question_embedding
         )
         
         return Answer(**result)
@@ -225,51 +323,105 @@ async def ask_question(request: QuestionRequest, current_user: User = Depends(ge
     except Exception as e:
         raise HTTPException(500, f"Error generating answer: {str(e)}")
 
+@app.post("/api/ask/stream")
+async def ask_question_stream(request: QuestionRequest, current_user: User = Depends(get_current_user)):
+    """Ask a question and stream the answer as newline-delimited JSON events
+    
+    Emits {"type": "token", "text": ...} as the answer is generated, then
+    {"type": "result", "data": ...} carrying the same fields as /api/ask.
+    """
+    try:
+        relevant_chunks, question_embedding = await retrieve_for_question(request, current_user)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"Error generating answer: {str(e)}")
+    
+    async def stream_answer():
+        async for event in qa_engine.generate_answer_stream(
+            request.question,
+            relevant_chunks,
+            request.conversation_history,
+            question_embedding=question_embedding
+        ):
+            if event["type"] == "result":
+                # Validate and trim the engine dict exactly like /api/ask's response_model
+                event = {"type": "result", "data": Answer(**event["data"]).model_dump()}
+            yield orjson.dumps(event) + b"\n"
+    
+    return StreamingResponse(stream_answer(), media_type="application/x-ndjson")
+
+def document_metadata(doc: Dict) -> DocumentMetadata:
+    """DocumentMetadata from a document projected with DOCUMENT_LIST_PROJECTION"""
+    return DocumentMetadata(
+        doc_id=doc["doc_id"],
+        filename=doc["filename"],
+        upload_time=doc["upload_time"],
+        total_pages=doc["total_pages"],
+        total_chunks=doc["metadata"]["total_chunks"],
+        summary=doc["metadata"]["summary"],
+        key_topics=doc["metadata"]["key_topics"],
+        estimated_reading_time=doc["metadata"]["estimated_reading_time"],
+        complexity_score=doc["metadata"]["complexity_score"]
+    )
+
 @app.get("/api/documents", response_model=List[DocumentMetadata])
 async def list_documents(current_user: User = Depends(get_current_user)):
-    """List all uploaded documents for the current user"""
+    """List all uploaded documents for the current user
+    
+    Up to DOCUMENT_LIST_PREFETCH documents are read before responding, so
+    database errors there still return a 500. Longer lists are streamed
+    after that; a body that is not a complete JSON array means the listing
+    failed partway and must be treated as an error by the client.
+    """
     try:
         # Query documents for the current user
-        cursor = documents_collection.find({"user_id": current_user.id}).sort("upload_time", -1)
-        documents = []
-        
-        async for doc in cursor:
-            documents.append(DocumentMetadata(
-                doc_id=doc["doc_id"],
-                filename=doc["filename"],
-                upload_time=doc["upload_time"],
-                total_pages=doc["total_pages"],
-                total_chunks=doc["metadata"]["total_chunks"],
-                summary=doc["metadata"]["summary"],
-                key_topics=doc["metadata"]["key_topics"],
-                estimated_reading_time=doc["metadata"]["estimated_reading_time"],
-                complexity_score=doc["metadata"]["complexity_score"]
-            ))
-        
-        return documents
+        cursor = documents_collection.find(
+            {"user_id": current_user.id},
+            DOCUMENT_LIST_PROJECTION
+        ).sort("upload_time", -1)
+        first_batch = [
+            document_metadata(doc)
+            for doc in await cursor.to_list(length=DOCUMENT_LIST_PREFETCH)
+        ]
     except Exception as e:
         raise HTTPException(500, f"Error loading documents: {str(e)}")
+    
+    if len(first_batch) < DOCUMENT_LIST_PREFETCH:
+        # The whole list is in hand: response_model validates and serializes it
+        return first_batch
+    
+    async def stream_documents():
+        # Emit a JSON array one document at a time instead of building the list
+        yield b"["
+        yield b",".join(orjson.dumps(item.model_dump()) for item in first_batch)
+        async for doc in cursor:
+            yield b"," + orjson.dumps(document_metadata(doc).model_dump())
+        yield b"]"
+    
+    return StreamingResponse(stream_documents(), media_type="application/json")
 
 @app.delete("/api/documents/{doc_id}")
 async def delete_document(doc_id: str, current_user: User = Depends(get_current_user)):
     """Delete a document"""
     try:
         # Find document in MongoDB
-        doc_doc = await documents_collection.find_one({
-            "doc_id": doc_id,
-            "user_id": current_user.id
-        })
+        doc_doc = await documents_collection.find_one(
+            {"doc_id": doc_id, "user_id": current_user.id},
+            {"file_path": 1}
+        )
         
         if not doc_doc:
             raise HTTPException(404, "Document not found")
         
         # Delete from vector store
         embedding_service.delete_document(doc_id)
+        query_cache.invalidate(doc_id)
         
         # Delete file
         file_path = doc_doc["file_path"]
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if await anyio.to_thread.run_sync(os.path.exists, file_path):
+            await anyio.to_thread.run_sync(os.remove, file_path)
         
         # Remove from MongoDB
         await documents_collection.delete_one({
@@ -288,56 +440,98 @@ async def delete_document(doc_id: str, current_user: User = Depends(get_current_
 async def compare_documents(request: ComparisonRequest):
     """Compare multiple documents"""
     try:
-        # Get chunks from each document
-        doc_chunks_map = {}
-        for doc_id in request.doc_ids:
-            chunks = embedding_service.search_similar(
-                request.question,
-                doc_ids=[doc_id],
-                top_k=3
+        # One filtered vector query for all documents, bucketed per document
+        cache_key = QueryCache.make_key(request.doc_ids, request.question, 3, kind="grouped")
+        doc_chunks_map = query_cache.get(cache_key)
+        if doc_chunks_map is None:
+            doc_chunks_map = await asyncio.to_thread(
+                embedding_service.search_similar_grouped, request.question, request.doc_ids, 3
             )
-            doc_chunks_map[doc_id] = chunks
+            if any(doc_chunks_map.values()):
+                query_cache.put(cache_key, doc_chunks_map)
         
         # Generate comparison
-        comparison = qa_engine.generate_comparison(request.question, doc_chunks_map)
+        comparison = await qa_engine.generate_comparison_async(request.question, doc_chunks_map)
         
         return {"comparison": comparison, "documents": list(doc_chunks_map.keys())}
     
     except Exception as e:
         raise HTTPException(500, f"Error comparing documents: {str(e)}")
 
+def document_suggestions(doc_doc: Dict) -> List[str]:
+    """Suggested questions stored on a document"""
+    # Suggestions are built at upload; older documents get them built on the fly
+    suggestions = doc_doc["metadata"].get("suggestions")
+    if suggestions is None:
+        suggestions = doc_processor.generate_suggestions(
+            doc_doc["filename"], doc_doc["metadata"]["key_topics"]
+        )
+    return suggestions
+
 @app.get("/api/suggestions/{doc_id}")
 async def get_question_suggestions(doc_id: str, current_user: User = Depends(get_current_user)):
     """Get suggested questions for a document"""
     try:
         # Find document in MongoDB
-        doc_doc = await documents_collection.find_one({
-            "doc_id": doc_id,
-            "user_id": current_user.id
-        })
+        doc_doc = await documents_collection.find_one(
+            {"doc_id": doc_id, "user_id": current_user.id},
+            {"filename": 1, "metadata.key_topics": 1, "metadata.suggestions": 1}
+        )
         
         if not doc_doc:
             raise HTTPException(404, "Document not found")
         
-        topics = doc_doc["metadata"]["key_topics"]
-        filename = doc_doc["filename"]
+        return {"suggestions": document_suggestions(doc_doc)}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"Error getting suggestions: {str(e)}")
+
+@app.post("/api/suggestions/{doc_id}/answers")
+async def answer_suggested_questions(doc_id: str, current_user: User = Depends(get_current_user)):
+    """Precompute answers to a document's suggested questions with one Gemini call"""
+    try:
+        doc_doc = await documents_collection.find_one(
+            {"doc_id": doc_id, "user_id": current_user.id},
+            {"filename": 1, "metadata.key_topics": 1, "metadata.suggestions": 1}
+        )
         
-        # Generate better questions based on document content
-        suggestions = [
-            f"What are the main topics covered in {filename}?",
-            f"Can you summarize the key points about {topics[0] if topics else 'this document'}?",
-            "What are the most important findings or conclusions?",
-            f"Explain the concept of {topics[1] if len(topics) > 1 else 'the main topic'} in detail.",
-            f"How does {topics[2] if len(topics) > 2 else 'this document'} relate to {topics[0] if topics else 'the main theme'}?"
-        ]
+        if not doc_doc:
+            raise HTTPException(404, "Document not found")
+        
+        suggestions = document_suggestions(doc_doc)
+        
+        # One retrieval over all the questions gives them a shared context
+        relevant_chunks = await search_chunks(" ".join(suggestions), [doc_id], top_k=10)
+        if not relevant_chunks:
+            raise HTTPException(404, "No relevant information found")
         
-        return {"suggestions": suggestions}
+        answers = await qa_engine.answer_questions_in_one_prompt(suggestions, relevant_chunks)
+        
+        return {
+            "answers": [
+                {"question": question, **Answer(**answer).model_dump()}
+                for question, answer in zip(suggestions, answers)
+            ]
+        }
     
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(500, f"Error getting suggestions: {str(e)}")
+        raise HTTPException(500, f"Error answering suggestions: {str(e)}")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # The vector store is in-process, so extra workers only make sense
+    # once it is shared; WEB_CONCURRENCY defaults to a single worker.
+    # uvicorn only needs the import string to spawn workers; passing the app
+    # object otherwise avoids importing (and loading the models) twice.
+    # loop/http stay "auto": uvloop and httptools are used when installed.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run(
+        "app.main:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8000,
+        workers=workers
+    )
\ No newline at end of file
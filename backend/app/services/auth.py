@@ -1,11 +1,13 @@
 import os
+import asyncio
 from datetime import datetime, timedelta
 from typing import Optional
 from passlib.context import CryptContext
-from jose import JWTError, jwt
+import jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from bson import ObjectId
+from cachetools import TTLCache
 
 from app.models import User, UserCreate, UserLogin, TokenData
 from app.services.database import db_service
@@ -14,7 +16,7 @@ from app.services.database import db_service
 pwd_context = CryptContext(
     schemes=["bcrypt"], 
     deprecated="auto",
-    bcrypt__rounds=12,
+    bcrypt__rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
     bcrypt__min_rounds=4,
     bcrypt__max_rounds=31
 )
@@ -27,6 +29,10 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # Security scheme
 security = HTTPBearer()
 
+# Short-lived cache of authenticated users, keyed by email
+USER_CACHE_TTL_SECONDS = 60
+user_cache: TTLCache = TTLCache(maxsize=10000, ttl=USER_CACHE_TTL_SECONDS)
+
 class AuthService:
     def __init__(self):
         self.users_collection = None
@@ -35,26 +41,21 @@ class AuthService:
         """Initialize the auth service"""
         self.users_collection = db_service.get_collection("users")
     
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+    @staticmethod
+    def _truncate_password(password: str) -> str:
+        """Truncate password to 72 bytes for bcrypt compatibility"""
+        return password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
+    
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
         """Verify a password against its hash"""
-        # Truncate password to 72 bytes for bcrypt compatibility
-        truncated_password = plain_password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
-        return pwd_context.verify(truncated_password, hashed_password)
+        # bcrypt is CPU-bound; keep it off the event loop
+        return await asyncio.to_thread(
+            pwd_context.verify, self._truncate_password(plain_password), hashed_password
+        )
     
-    def get_password_hash(self, password: str) -> str:
+    async def get_password_hash(self, password: str) -> str:
         """Hash a password"""
-        # Debug: Check password length
-        password_bytes = password.encode('utf-8')
-        print(f"DEBUG: Password length: {len(password)} chars, {len(password_bytes)} bytes")
-        
-        try:
-            # Simple approach - just hash the password as-is
-            return pwd_context.hash(password)
-        except Exception as e:
-            print(f"DEBUG: Bcrypt error: {e}")
-            # Fallback: truncate if needed
-            truncated_password = password_bytes[:72].decode('utf-8', errors='ignore')
-            return pwd_context.hash(truncated_password)
+        return await asyncio.to_thread(pwd_context.hash, self._truncate_password(password))
     
     def create_access_token(self, data: dict, expires_delta: Optional[timedelta] = None):
         """Create a JWT access token"""
@@ -77,7 +78,7 @@ class AuthService:
         if not user_doc:
             return None
         
-        if not self.verify_password(password, user_doc["hashed_password"]):
+        if not await self.verify_password(password, user_doc["hashed_password"]):
             return None
         
         return User(
@@ -105,7 +106,7 @@ class AuthService:
         user_doc = {
             "email": user.email,
             "full_name": user.full_name,
-            "hashed_password": self.get_password_hash(user.password),
+            "hashed_password": await self.get_password_hash(user.password),
             "created_at": datetime.utcnow(),
             "is_active": True
         }
@@ -176,12 +177,15 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if email is None:
             raise credentials_exception
         token_data = TokenData(email=email)
-    except JWTError:
+    except jwt.PyJWTError:
         raise credentials_exception
     
-    user = await auth_service.get_user_by_email(email=token_data.email)
+    user = user_cache.get(token_data.email)
     if user is None:
-        raise credentials_exception
+        user = await auth_service.get_user_by_email(email=token_data.email)
+        if user is None:
+            raise credentials_exception
+        user_cache[token_data.email] = user
     
     return user
 
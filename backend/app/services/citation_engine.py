@@ -1,66 +1,85 @@
-from typing import List, Dict, Tuple
-import re
+from typing import List, Dict, FrozenSet, Set, Tuple
+import numpy as np
+
+from app.utils.text_patterns import tokenize, split_sentences
+
+_STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'been', 'be',
+    'this', 'that', 'these', 'those', 'it', 'its', 'which', 'who', 'what',
+    'have', 'has', 'had', 'will', 'would', 'can', 'could', 'may', 'might',
+    'should', 'shall', 'must', 'do', 'does', 'did', 'not', 'no', 'nor',
+    'am', 'were', 'been', 'being', 'you', 'your', 'we', 'our', 'they', 'their'
+})
 
 class CitationEngine:
     def __init__(self):
-        self.stop_words = {
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
-            'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'been', 'be',
-            'this', 'that', 'these', 'those', 'it', 'its', 'which', 'who', 'what',
-            'have', 'has', 'had', 'will', 'would', 'can', 'could', 'may', 'might',
-            'should', 'shall', 'must', 'do', 'does', 'did', 'not', 'no', 'nor',
-            'am', 'were', 'been', 'being', 'you', 'your', 'we', 'our', 'they', 'their'
-        }
+        self.stop_words = _STOP_WORDS
     
     def create_citations(self, chunks: List[Dict], answer_text: str) -> List[Dict]:
         """
         Create citations by matching answer text with source chunks
         """
-        citations = []
+        n = len(chunks)
+        if n == 0:
+            return []
         
-        for idx, chunk in enumerate(chunks):
-            # Calculate multiple relevance metrics
-            word_overlap = self._calculate_word_overlap(chunk["text"], answer_text)
-            semantic_score = chunk.get("confidence", 0.5)  # From embedding similarity
-            position_bonus = (len(chunks) - idx) / len(chunks) * 0.2  # Earlier results slightly favored
-            
-            # Combined relevance score
-            relevance_score = (word_overlap * 0.5) + (semantic_score * 0.3) + position_bonus
-            
-            citation = {
+        answer_words = self._meaningful_words(answer_text)
+        
+        # Score every chunk column-wise; only the top 5 become citation dicts
+        chunk_words = [self._chunk_words(chunk) for chunk in chunks]
+        word_overlap = np.fromiter(
+            (self._calculate_word_overlap(words, answer_words) for words in chunk_words), float, n
+        )
+        confidence = np.fromiter((chunk.get("confidence", 0.5) for chunk in chunks), float, n)  # From embedding similarity
+        position_bonus = (n - np.arange(n)) / n * 0.2  # Earlier results slightly favored
+        
+        # Combined relevance score
+        raw_relevance = (word_overlap * 0.5) + (confidence * 0.3) + position_bonus
+        relevance = np.fromiter((round(r, 3) for r in raw_relevance.tolist()), float, n)
+        
+        # Best 5 by combined relevance, then confidence: relevance moves in steps of
+        # 0.001, so a 1e-6 confidence term only breaks ties. Partition instead of a
+        # full sort; keeping everything up to the 5th key in index order lets the
+        # stable sort still prefer earlier chunks on exact ties
+        key = -(relevance + 1e-6 * confidence)
+        threshold = np.partition(key, min(4, n - 1))[min(4, n - 1)]
+        candidates = np.flatnonzero(key <= threshold)
+        order = candidates[np.argsort(key[candidates], kind="stable")[:5]]
+        
+        citations = []
+        for idx in order.tolist():
+            chunk = chunks[idx]
+            citations.append({
                 "citation_id": idx + 1,
-                "text": self._extract_relevant_snippet(chunk["text"], answer_text),
+                "text": self._extract_relevant_snippet(chunk["text"], answer_words & chunk_words[idx]),
                 "full_text": chunk["text"][:500],
                 "doc_id": chunk["doc_id"],
                 "chunk_id": chunk["chunk_id"],
                 "page_number": chunk.get("page_number", 1),
-                "confidence": semantic_score,
-                "relevance_score": round(relevance_score, 3),
-                "word_overlap": round(word_overlap, 3)
-            }
-            
-            citations.append(citation)
+                "confidence": chunk.get("confidence", 0.5),
+                "relevance_score": float(relevance[idx]),
+                "word_overlap": round(float(word_overlap[idx]), 3)
+            })
         
-        # Sort by combined relevance
-        citations.sort(key=lambda x: (-x["relevance_score"], -x["confidence"]))
-        
-        return citations[:5]
+        return citations
+    
+    def _meaningful_words(self, text: str) -> Set[str]:
+        """Lowercased words longer than 3 chars that are not stop words"""
+        return {word for word in tokenize(text) if len(word) > 3 and word not in self.stop_words}
+    
+    def _chunk_words(self, chunk: Dict) -> FrozenSet[str]:
+        """Meaningful words of a chunk, memoized on the chunk dict"""
+        words = chunk.get("_wordset")
+        if words is None:
+            words = frozenset(self._meaningful_words(chunk["text"]))
+            chunk["_wordset"] = words
+        return words
     
-    def _calculate_word_overlap(self, source_text: str, answer_text: str) -> float:
+    def _calculate_word_overlap(self, source_words: FrozenSet[str], answer_words: Set[str]) -> float:
         """
         Calculate meaningful word overlap between source and answer
         """
-        # Extract meaningful words (longer than 3 chars, not stop words)
-        source_words = set(
-            word.lower() for word in re.findall(r'\b\w+\b', source_text)
-            if len(word) > 3 and word.lower() not in self.stop_words
-        )
-        
-        answer_words = set(
-            word.lower() for word in re.findall(r'\b\w+\b', answer_text)
-            if len(word) > 3 and word.lower() not in self.stop_words
-        )
-        
         if not answer_words:
             return 0.0
         
@@ -72,32 +91,26 @@ class CitationEngine:
         
         return min(1.0, overlap_score)
     
-    def _extract_relevant_snippet(self, source_text: str, answer_text: str, context_window: int = 200) -> str:
+    def _extract_relevant_snippet(self, source_text: str, answer_words: Set[str], context_window: int = 200) -> str:
         """
         Extract the most relevant snippet from source text
         """
         # Split into sentences
-        sentences = re.split(r'[.!?]+', source_text)
+        sentences = split_sentences(source_text)
         sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
         
         if not sentences:
             return source_text[:context_window] + "..."
         
-        # Extract meaningful words from answer
-        answer_words = set(
-            word.lower() for word in re.findall(r'\b\w{4,}\b', answer_text)
-            if word.lower() not in self.stop_words
-        )
-        
-        # Find best matching sentence
+        # Find best matching sentence (answer_words is already narrowed to
+        # words present in this chunk, so no overlap means the first sentence)
         best_sentence = sentences[0]
         best_score = 0
         
-        for sentence in sentences:
-            sentence_words = set(
-                word.lower() for word in re.findall(r'\b\w{4,}\b', sentence)
-            )
-            overlap = len(answer_words.intersection(sentence_words))
+        for sentence in (sentences if answer_words else ()):
+            # answer_words only holds 4+ char words, so probing it with the raw
+            # token list needs no length filter or intermediate set
+            overlap = len(answer_words.intersection(tokenize(sentence)))
             
             if overlap > best_score:
                 best_score = overlap
@@ -112,7 +125,10 @@ class CitationEngine:
     
     def _calculate_relevance(self, source_text: str, answer_text: str) -> float:
         """Calculate relevance score"""
-        return self._calculate_word_overlap(source_text, answer_text)
+        return self._calculate_word_overlap(
+            frozenset(self._meaningful_words(source_text)),
+            self._meaningful_words(answer_text)
+        )
     
     def verify_citation_accuracy(self, answer: str, citations: List[Dict]) -> Dict:
         """
@@ -130,11 +146,15 @@ class CitationEngine:
                 "citation_quality": "none"
             }
         
+        relevance = np.fromiter((c.get("relevance_score", 0) for c in citations), float, total_citations)
+        confidence = np.fromiter((c.get("confidence", 0) for c in citations), float, total_citations)
+        pages = np.fromiter((c["page_number"] for c in citations), np.int64, total_citations)
+        
         # Count highly relevant citations (relevance > 0.3)
-        relevant_citations = sum(1 for c in citations if c.get("relevance_score", 0) > 0.3)
+        relevant_citations = int((relevance > 0.3).sum())
         
-        avg_confidence = sum(c.get("confidence", 0) for c in citations) / total_citations
-        avg_relevance = sum(c.get("relevance_score", 0) for c in citations) / total_citations
+        avg_confidence = float(confidence.mean())
+        avg_relevance = float(relevance.mean())
         
         # Determine quality based on both metrics
         if avg_relevance > 0.5 and avg_confidence > 0.5:
@@ -151,6 +171,6 @@ class CitationEngine:
             "relevant_citations": relevant_citations,
             "average_confidence": round(avg_confidence, 2),
             "average_relevance": round(avg_relevance, 2),
-            "pages_cited": sorted(set(c["page_number"] for c in citations)),
+            "pages_cited": np.unique(pages).tolist(),
             "citation_quality": quality
         }
\ No newline at end of file
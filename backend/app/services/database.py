@@ -1,6 +1,6 @@
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
+from pymongo import IndexModel, MongoClient
 from typing import Optional
 import asyncio
 
@@ -21,7 +21,17 @@ class DatabaseService:
     async def connect(self):
         """Connect to MongoDB"""
         try:
-            self.async_client = AsyncIOMotorClient(self.mongo_url)
+            # One pooled client per process: db_service below is a module global,
+            # so every request handler in a worker shares this connection pool
+            self.async_client = AsyncIOMotorClient(
+                self.mongo_url,
+                maxPoolSize=int(os.getenv("MONGO_POOL", "50")),
+                # Compressors missing from the environment are skipped by the driver
+                compressors=os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib"),
+                retryWrites=True,
+                serverSelectionTimeoutMS=3000,
+                uuidRepresentation="standard"
+            )
             self.async_db = self.async_client[self.database_name]
             
             # Test connection
@@ -44,19 +54,30 @@ class DatabaseService:
     async def create_indexes(self):
         """Create database indexes for better performance"""
         try:
-            # Users collection indexes
-            await self.async_db.users.create_index("email", unique=True)
-            await self.async_db.users.create_index("created_at")
-            
-            # Documents collection indexes
-            await self.async_db.documents.create_index("user_id")
-            await self.async_db.documents.create_index("upload_time")
-            await self.async_db.documents.create_index([("user_id", 1), ("upload_time", -1)])
-            
-            # Chat history collection indexes
-            await self.async_db.chat_history.create_index("user_id")
-            await self.async_db.chat_history.create_index([("user_id", 1), ("doc_ids", 1)])
-            await self.async_db.chat_history.create_index("created_at")
+            # One bulk create_indexes round-trip per collection, all three in flight together
+            await asyncio.gather(
+                # Users collection indexes
+                self.async_db.users.create_indexes([
+                    IndexModel("email", unique=True),
+                    IndexModel("created_at")
+                ]),
+                
+                # Documents collection indexes
+                self.async_db.documents.create_indexes([
+                    IndexModel("user_id"),
+                    IndexModel("upload_time"),
+                    IndexModel([("user_id", 1), ("doc_id", 1)], unique=True),
+                    IndexModel([("user_id", 1), ("upload_time", -1)]),
+                    IndexModel([("user_id", 1), ("content_sha256", 1)])
+                ]),
+                
+                # Chat history collection indexes
+                self.async_db.chat_history.create_indexes([
+                    IndexModel("user_id"),
+                    IndexModel([("user_id", 1), ("doc_ids", 1)]),
+                    IndexModel("created_at")
+                ])
+            )
             
             print("📊 Database indexes created successfully")
             
@@ -1,11 +1,93 @@
 import fitz  # PyMuPDF
 import uuid
 import os
+import logging
 from typing import List, Dict, Tuple
-import re
 from collections import Counter
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+from app.utils.text_patterns import tokenize, split_sentences, count_sentences
+
+logger = logging.getLogger(__name__)
+
+_TOPIC_STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'been', 'be',
+    'this', 'that', 'these', 'those', 'it', 'its', 'which', 'who', 'what',
+    'have', 'has', 'had', 'will', 'would', 'can', 'could', 'may', 'might'
+})
+
+# Numba is optional; without it _find_page runs as plain Python
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+@njit(cache=True)
+def _find_page(char_start, char_end, page_starts, page_ends, page_mids, page_nums):
+    """Page holding >30% of the chunk, else the page with the nearest midpoint.
+
+    Pages are sorted and non-overlapping, so only the pages between the two
+    binary-search bounds can overlap the chunk.
+    """
+    n = page_starts.shape[0]
+    if n == 0:
+        return 1
+    
+    length = char_end - char_start
+    i = np.searchsorted(page_ends, char_start, side='right')
+    while i < n and page_starts[i] < char_end:
+        overlap = min(char_end, page_ends[i]) - max(char_start, page_starts[i])
+        if overlap > 0 and overlap / length > 0.3:
+            return page_nums[i]
+        i += 1
+    
+    # Fallback: closest page midpoint, earliest page wins ties
+    midpoint = (char_start + char_end) / 2
+    j = np.searchsorted(page_mids, midpoint)
+    if j == n or (j > 0 and midpoint - page_mids[j - 1] <= page_mids[j] - midpoint):
+        j -= 1
+    return page_nums[j]
+
+# PDFs with fewer pages than this are read serially; forking isn't worth it
+PARALLEL_PDF_MIN_PAGES = 4
+PARALLEL_PDF_MAX_WORKERS = 8
+
+def _extract_page_range(args: Tuple[str, int, int]) -> List[str]:
+    """Plain text of pages [start, stop) of a PDF; top-level so it pickles"""
+    file_path, start, stop = args
+    doc = fitz.open(file_path)
+    try:
+        # Plain text extraction, no layout dict/blocks
+        return [doc[i].get_text("text") for i in range(start, stop)]
+    finally:
+        doc.close()
+
+def _extract_pages(file_path: str) -> List[str]:
+    """Plain text of every page, split across processes for large PDFs
+    
+    Inside a worker process (the upload pool) pages are read serially: that
+    pool already spreads uploads over the cores, and nesting a pool per file
+    would multiply the process count under concurrent uploads.
+    """
+    doc = fitz.open(file_path)
+    page_count = len(doc)
+    doc.close()
+    
+    workers = min(PARALLEL_PDF_MAX_WORKERS, os.cpu_count() or 1, page_count)
+    in_worker = multiprocessing.parent_process() is not None
+    if in_worker or page_count < PARALLEL_PDF_MIN_PAGES or workers < 2:
+        return _extract_page_range((file_path, 0, page_count))
+    
+    # One contiguous page range per worker, so each opens the file once
+    step = -(-page_count // workers)
+    ranges = [(file_path, start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        return [text for texts in executor.map(_extract_page_range, ranges) for text in texts]
+
 class DocumentProcessor:
     def __init__(self):
         self.chunk_size = 800  # Increased for better context
@@ -14,43 +96,38 @@ class DocumentProcessor:
     def extract_text_from_pdf(self, file_path: str) -> Tuple[str, int, List[Dict]]:
         """Extract text from PDF with accurate page information"""
         try:
-            doc = fitz.open(file_path)
-            full_text = ""
+            raw_pages = _extract_pages(file_path)
+            parts = []
             page_texts = []
+            running_len = 0
             
-            print(f"DEBUG: PDF has {len(doc)} pages")
+            logger.debug("PDF has %d pages", len(raw_pages))
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                text = page.get_text()
-                
-                print(f"DEBUG: Page {page_num + 1} - Text length: {len(text)}")
-                
-                # Clean up text
+            for page_num, text in enumerate(raw_pages):
                 text = text.strip()
                 
                 if text:  # Only add non-empty pages
                     page_texts.append({
                         "page_number": page_num + 1,
                         "text": text,
-                        "char_start": len(full_text),
-                        "char_end": len(full_text) + len(text)
+                        "char_start": running_len,
+                        "char_end": running_len + len(text)
                     })
-                    full_text += f"\n{text}\n"
+                    parts.append(text)
+                    running_len += len(text) + 2  # surrounding newlines
                 else:
-                    print(f"DEBUG: Page {page_num + 1} is empty or contains no extractable text")
+                    logger.debug("Page %d is empty or contains no extractable text", page_num + 1)
             
-            doc.close()
+            page_count = len(raw_pages)
             
             if not page_texts:
                 print("WARNING: No text could be extracted from PDF. This might be a scanned document.")
-                # Try to get at least some basic info
-                doc = fitz.open(file_path)
-                page_count = len(doc)
-                doc.close()
                 return "", page_count, []
             
-            print(f"DEBUG: Successfully extracted text from {len(page_texts)} pages")
+            # Same layout as appending f"\n{text}\n" per page
+            full_text = "\n" + "\n\n".join(parts) + "\n"
+            
+            logger.debug("Successfully extracted text from %d pages", len(page_texts))
             return full_text, len(page_texts), page_texts
             
         except Exception as e:
@@ -85,16 +162,27 @@ class DocumentProcessor:
         chunks = []
         chunk_id = 0
         
+        # Join once and slice chunks out of it; prefix[i] is where word i
+        # starts in normalized, and prefix[i] - 1 is len(' '.join(words[:i]))
+        normalized = ' '.join(words)
+        prefix = np.zeros(len(words) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter((len(w) + 1 for w in words), np.int64, len(words)), out=prefix[1:])
+        
+        page_starts = np.array([p["char_start"] for p in page_texts], dtype=np.int64)
+        page_ends = np.array([p["char_end"] for p in page_texts], dtype=np.int64)
+        page_mids = (page_starts + page_ends) / 2
+        page_nums = np.array([p["page_number"] for p in page_texts], dtype=np.int64)
+        
         for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk_words = words[i:i + self.chunk_size]
-            chunk_text = ' '.join(chunk_words)
+            end = min(i + self.chunk_size, len(words))
+            chunk_text = normalized[prefix[i]:prefix[end] - 1]
             
             # Calculate character position of this chunk
-            char_start = len(' '.join(words[:i]))
+            char_start = int(prefix[i] - (1 if i else 0))
             char_end = char_start + len(chunk_text)
             
             # Find which page this chunk belongs to
-            page_num = self._find_page_for_chunk(char_start, char_end, page_texts)
+            page_num = int(_find_page(char_start, char_end, page_starts, page_ends, page_mids, page_nums))
             
             # Get a snippet for better context matching
             snippet = chunk_text[:100] if len(chunk_text) > 100 else chunk_text
@@ -104,7 +192,7 @@ class DocumentProcessor:
                 "text": chunk_text,
                 "page_number": page_num,
                 "start_index": i,
-                "end_index": i + len(chunk_words),
+                "end_index": end,
                 "char_start": char_start,
                 "char_end": char_end,
                 "snippet": snippet
@@ -113,78 +201,72 @@ class DocumentProcessor:
         
         return chunks
     
-    def _find_page_for_chunk(self, char_start: int, char_end: int, page_texts: List[Dict]) -> int:
-        """Find which page a chunk belongs to based on character position"""
-        # Find the page that contains the majority of this chunk
-        for page_info in page_texts:
-            page_start = page_info.get("char_start", 0)
-            page_end = page_info.get("char_end", float('inf'))
-            
-            # Check if chunk overlaps with this page
-            overlap_start = max(char_start, page_start)
-            overlap_end = min(char_end, page_end)
-            
-            if overlap_end > overlap_start:
-                # This page contains part of the chunk
-                overlap_ratio = (overlap_end - overlap_start) / (char_end - char_start)
-                
-                if overlap_ratio > 0.3:  # If >30% of chunk is in this page
-                    return page_info["page_number"]
-        
-        # Fallback: find closest page
-        chunk_midpoint = (char_start + char_end) / 2
-        closest_page = 1
-        min_distance = float('inf')
-        
-        for page_info in page_texts:
-            page_midpoint = (page_info.get("char_start", 0) + page_info.get("char_end", 0)) / 2
-            distance = abs(chunk_midpoint - page_midpoint)
-            
-            if distance < min_distance:
-                min_distance = distance
-                closest_page = page_info["page_number"]
-        
-        return closest_page
-    
     def generate_summary(self, text: str) -> str:
         """Generate a quick extractive summary"""
-        sentences = re.split(r'[.!?]+', text)
+        sentences = split_sentences(text)
         meaningful = [s.strip() for s in sentences if len(s.strip()) > 50][:3]
         return '. '.join(meaningful) + '.' if meaningful else "Document uploaded successfully."
     
-    def extract_key_topics(self, text: str, top_n: int = 10) -> List[str]:
-        """Extract key topics using simple frequency analysis"""
-        stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
-                     'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'been', 'be',
-                     'this', 'that', 'these', 'those', 'it', 'its', 'which', 'who', 'what',
-                     'have', 'has', 'had', 'will', 'would', 'can', 'could', 'may', 'might'}
-        
-        words = re.findall(r'\b[a-z]{4,}\b', text.lower())
-        filtered_words = [w for w in words if w not in stop_words]
+    def _scan(self, text: str) -> Tuple[Counter, int, int, int]:
+        """One pass of text statistics shared by the metadata helpers.
+
+        Returns (topic word counts, word count, total word chars, sentence count).
+        """
+        words = text.split()
+        total_chars = sum(map(len, words))
+        sentence_count = count_sentences(text)
         
-        counter = Counter(filtered_words)
+        # Same tokens as \b[a-z]{4,}\b: tokenize() splits on every non-\w
+        # character (curly quotes, dashes and bullets included), so a \w run
+        # that is all ASCII letters and 4+ long is exactly one regex match.
+        # Count every token in C, then filter the (far fewer) distinct words
+        counts = Counter(tokenize(text))
+        for w in _TOPIC_STOP_WORDS:
+            counts.pop(w, None)
+        topic_counts = Counter({
+            w: c for w, c in counts.items()
+            if len(w) > 3 and w.isascii() and w.isalpha()
+        })
+        return topic_counts, len(words), total_chars, sentence_count
+    
+    def extract_key_topics(self, text: str, top_n: int = 10, scan=None) -> List[str]:
+        """Extract key topics using simple frequency analysis"""
+        counter, _, _, _ = scan or self._scan(text)
         return [word for word, count in counter.most_common(top_n)]
     
-    def calculate_complexity_score(self, text: str) -> float:
+    def calculate_complexity_score(self, text: str, scan=None) -> float:
         """Calculate document complexity (0-1 scale)"""
-        words = text.split()
-        if not words:
+        _, word_count, total_chars, sentence_count = scan or self._scan(text)
+        if not word_count:
             return 0.0
         
-        avg_word_length = sum(len(w) for w in words) / len(words)
-        sentences = re.split(r'[.!?]+', text)
-        avg_sentence_length = len(words) / max(len(sentences), 1)
+        avg_word_length = total_chars / word_count
+        avg_sentence_length = word_count / max(sentence_count, 1)
         
         complexity = min((avg_word_length / 10 + avg_sentence_length / 30) / 2, 1.0)
         return round(complexity, 2)
     
-    def estimate_reading_time(self, text: str) -> int:
+    def estimate_reading_time(self, text: str, scan=None) -> int:
         """Estimate reading time in minutes (assuming 200 words/min)"""
-        word_count = len(text.split())
+        _, word_count, _, _ = scan or self._scan(text)
         return max(1, word_count // 200)
     
+    def generate_suggestions(self, filename: str, topics: List[str]) -> List[str]:
+        """Build starter questions for a document from its key topics"""
+        return [
+            f"What are the main topics covered in {filename}?",
+            f"Can you summarize the key points about {topics[0] if topics else 'this document'}?",
+            "What are the most important findings or conclusions?",
+            f"Explain the concept of {topics[1] if len(topics) > 1 else 'the main topic'} in detail.",
+            f"How does {topics[2] if len(topics) > 2 else 'this document'} relate to {topics[0] if topics else 'the main theme'}?"
+        ]
+    
     async def process_document(self, file_path: str, filename: str) -> Dict:
         """Main processing pipeline"""
+        return self.process_document_sync(file_path, filename)
+    
+    def process_document_sync(self, file_path: str, filename: str) -> Dict:
+        """Blocking processing pipeline, safe to run in a worker process"""
         try:
             doc_id = str(uuid.uuid4())
             
@@ -213,24 +295,26 @@ class DocumentProcessor:
                 print(f"Chunk {chunk['chunk_id']}: Page {chunk['page_number']}")
             
             # Generate metadata
+            scan = self._scan(full_text)
             summary = self.generate_summary(full_text)
-            key_topics = self.extract_key_topics(full_text)
-            complexity = self.calculate_complexity_score(full_text)
-            reading_time = self.estimate_reading_time(full_text)
+            key_topics = self.extract_key_topics(full_text, scan=scan)
+            complexity = self.calculate_complexity_score(full_text, scan=scan)
+            reading_time = self.estimate_reading_time(full_text, scan=scan)
             
+            # Only what upload_document stores: the result is pickled back from
+            # the upload pool, and the raw text would roughly double that cost
             return {
                 "doc_id": doc_id,
                 "filename": filename,
-                "full_text": full_text,
                 "chunks": chunks,
                 "total_pages": total_pages,
-                "page_texts": page_texts,
                 "metadata": {
                     "summary": summary,
                     "key_topics": key_topics,
                     "complexity_score": complexity,
                     "estimated_reading_time": reading_time,
-                    "total_chunks": len(chunks)
+                    "total_chunks": len(chunks),
+                    "suggestions": self.generate_suggestions(filename, key_topics)
                 }
             }
             
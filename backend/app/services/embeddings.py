@@ -32,9 +32,17 @@ class FilteredStderr:
 # sys.stderr = FilteredStderr(sys.stderr)
 
 from sentence_transformers import SentenceTransformer
+import torch
 import chromadb
-from typing import List, Dict
+from typing import List, Dict, Optional
+from collections import OrderedDict
 import numpy as np
+import hashlib
+import sqlite3
+import threading
+import time
+
+from app.services.vector_index import VectorIndex
 
 # Additional telemetry patch after import
 try:
@@ -55,110 +63,332 @@ try:
 except:
     pass
 
+# Chroma validates numpy embeddings natively from 0.5; older releases only
+# accept nested lists, so the ndarray -> list round-trip is kept for them
+_CHROMA_ACCEPTS_NDARRAY = tuple(int(p) for p in chromadb.__version__.split(".")[:2] if p.isdigit()) >= (0, 5)
+
+def _chroma_embeddings(vectors: np.ndarray):
+    """Pass a float32 matrix to Chroma without a Python float per element when supported"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    return vectors if _CHROMA_ACCEPTS_NDARRAY else vectors.tolist()
+
+class EmbeddingCache:
+    """SHA-256 keyed LRU+TTL cache for query embeddings, backed by SQLite"""
+
+    def __init__(self, model_name: str, path: Optional[str] = None, max_size: int = 5000,
+                 ttl: float = 3600.0, max_rows: int = 50000):
+        # Keys include the model so a model swap never serves stale vectors
+        self.model_name = model_name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        # key -> (wall-clock time first stored, vector); the time survives reloads
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._db = None
+        path = path or os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(hash TEXT PRIMARY KEY, dim INT, vec BLOB, created REAL)"
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Embedding cache running in memory only: {e}")
+            self._db = None
+
+    def make_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text.strip().lower()}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, vec = entry
+                if time.time() - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vec
+                del self._entries[key]
+
+            entry = self._load(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._remember(key, *entry)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, vec: np.ndarray):
+        # Cached vectors are shared between requests, so freeze them
+        vec = np.array(vec, dtype=np.float32)
+        vec.flags.writeable = False
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, vec)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                        (key, int(vec.shape[0]), vec.tobytes(), created)
+                    )
+                    self._puts += 1
+                    if self._puts % 100 == 0:
+                        # Keep the table bounded: drop expired rows and all but the newest max_rows
+                        self._db.execute(
+                            "DELETE FROM query_embeddings WHERE created < ? OR hash NOT IN "
+                            "(SELECT hash FROM query_embeddings ORDER BY created DESC LIMIT ?)",
+                            (created - self.ttl, self.max_rows)
+                        )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"⚠️ Could not persist query embedding: {e}")
+
+    def _remember(self, key: str, created: float, vec: np.ndarray):
+        self._entries[key] = (created, vec)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[tuple]:
+        """(created, vector) for an unexpired persisted entry, else None"""
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT created, dim, vec FROM query_embeddings WHERE hash = ? AND created >= ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        created, dim, blob = row
+        return created, np.frombuffer(blob, dtype=np.float32, count=dim)
+
 class EmbeddingService:
     def __init__(self):
         print("⚙️  Initializing embedding service...")
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model_name = 'all-MiniLM-L6-v2'
+        self.model = SentenceTransformer(model_name, device=device)
+        if device == "cuda":
+            # Half precision halves memory traffic; outputs are cast back to float32
+            self.model.half()
+        else:
+            torch.set_num_threads(os.cpu_count() or 1)
+        print(f"✓ Embedding model loaded on {device}")
+        self.query_cache = EmbeddingCache(model_name)
+        
+        # Exact inner-product index used for searches; Chroma stays the store of record
+        self.index = VectorIndex(self.model.get_sentence_embedding_dimension())
+        self._doc_chunk_counts: Dict[str, int] = {}
         
-        # Initialize ChromaDB with EphemeralClient
-        self.client = chromadb.EphemeralClient()
+        # Persistent ChromaDB so embeddings survive restarts
+        self.client = chromadb.PersistentClient(path=os.getenv("CHROMA_PATH", "./chroma_data"))
         
         # Create or get collection
         try:
             self.collection = self.client.get_or_create_collection(
                 name="documents",
-                metadata={"hnsw:space": "cosine"}
+                metadata={"hnsw:space": "ip"}
             )
             print("✓ ChromaDB collection ready")
         except Exception as e:
             print(f"✗ Collection creation error: {e}")
             self.collection = self.client.create_collection(name="documents")
+        
+        self._load_index()
+    
+    def _load_index(self):
+        """Rebuild the search index and chunk counts from persisted chunks"""
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                stored = self.collection.get(include=["embeddings", "documents", "metadatas"])
+        except Exception as e:
+            print(f"✗ Could not load stored embeddings: {e}")
+            return
+        
+        by_doc: Dict[str, List[tuple]] = {}
+        for vec, text, metadata in zip(stored["embeddings"], stored["documents"], stored["metadatas"]):
+            by_doc.setdefault(metadata["doc_id"], []).append((vec, text, metadata))
+        
+        for doc_id, rows in by_doc.items():
+            rows.sort(key=lambda row: row[2]["chunk_id"])
+            self._doc_chunk_counts[doc_id] = len(rows)
+            self.index.add(
+                doc_id,
+                np.array([row[0] for row in rows], dtype=np.float32),
+                [row[1] for row in rows],
+                [row[2]["chunk_id"] for row in rows],
+                [row[2].get("page_number", 1) for row in rows]
+            )
+        
+        if by_doc:
+            print(f"✓ Loaded {len(stored['ids'])} stored chunks for {len(by_doc)} documents")
     
     def embed_chunks(self, chunks: List[Dict], doc_id: str):
         """Embed and store document chunks"""
         texts = [chunk["text"] for chunk in chunks]
-        embeddings = self.model.encode(texts, show_progress_bar=False)
+        embeddings = self.model.encode(
+            texts,
+            batch_size=64,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype(np.float32)
         
         # Store in ChromaDB
         ids = [f"{doc_id}_{chunk['chunk_id']}" for chunk in chunks]
         metadatas = [
             {
                 "doc_id": doc_id,
-                "chunk_id": str(chunk["chunk_id"]),
-                "page_number": str(chunk.get("page_number", 1)),
+                "chunk_id": int(chunk["chunk_id"]),
+                "page_number": int(chunk.get("page_number", 1)),
                 "snippet": chunk.get("snippet", chunk["text"][:100])
             }
             for chunk in chunks
         ]
         
         self.collection.add(
-            embeddings=embeddings.tolist(),
+            embeddings=_chroma_embeddings(embeddings),
             documents=texts,
             metadatas=metadatas,
             ids=ids
         )
         
+        self._doc_chunk_counts[doc_id] = len(chunks)
+        self.index.add(
+            doc_id,
+            embeddings,
+            texts,
+            [m["chunk_id"] for m in metadatas],
+            [m["page_number"] for m in metadatas]
+        )
+        
         print(f"✓ Embedded {len(chunks)} chunks for document {doc_id[:8]}")
     
+    def embed_query_cached(self, text: str) -> np.ndarray:
+        """Embed a query as a unit vector, reusing it for previously seen text"""
+        key = self.query_cache.make_key(text)
+        vec = self.query_cache.get(key)
+        if vec is None:
+            vec = self.model.encode([text], normalize_embeddings=True)[0].astype(np.float32)
+            self.query_cache.put(key, vec)
+        return vec
+    
     def search_similar(self, query: str, doc_ids: List[str] = None, top_k: int = 10) -> List[Dict]:
         """Search for similar chunks"""
-        query_embedding = self.model.encode([query])[0]
+        query_embedding = self.embed_query_cached(query)
         
-        where_filter = None
-        if doc_ids:
-            where_filter = {"doc_id": {"$in": doc_ids}}
+        if self._indexed(doc_ids):
+            chunks = [self._from_index_hit(hit) for hit in self.index.search(query_embedding, doc_ids, top_k)]
+            print(f"✓ Found {len(chunks)} relevant chunks")
+            return chunks
         
         try:
-            # Suppress individual operation telemetry
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                
-                if where_filter:
-                    try:
-                        available_docs = self.collection.get(where=where_filter)
-                        available_count = len(available_docs['ids']) if available_docs.get('ids') else 0
-                    except:
-                        available_count = top_k
-                else:
-                    try:
-                        available_count = self.collection.count()
-                    except:
-                        available_count = top_k
-                
-                n_results = min(top_k, max(1, available_count))
-                
-                results = self.collection.query(
-                    query_embeddings=[query_embedding.tolist()],
-                    n_results=n_results,
-                    where=where_filter
-                )
-            
+            results = self._query(query_embedding, doc_ids, top_k)
             print(f"✓ Found {len(results['documents'][0])} relevant chunks")
-            
         except Exception as e:
             print(f"✗ Search error: {e}")
             return []
         
-        # Format results
+        chunks = self._format_results(results)
+        chunks.sort(key=lambda x: -x['confidence'])
+        return chunks
+    
+    def search_similar_grouped(self, query: str, doc_ids: List[str], top_k_per_doc: int = 3) -> Dict[str, List[Dict]]:
+        """Search several documents in one query and bucket the hits per document"""
+        grouped = {doc_id: [] for doc_id in doc_ids}
+        if not doc_ids:
+            return grouped
+        
+        query_embedding = self.embed_query_cached(query)
+        
+        if self._indexed(doc_ids):
+            for doc_id in grouped:
+                grouped[doc_id] = [
+                    self._from_index_hit(hit)
+                    for hit in self.index.search(query_embedding, [doc_id], top_k_per_doc)
+                ]
+            print(f"✓ Found {sum(len(v) for v in grouped.values())} relevant chunks across {len(doc_ids)} documents")
+            return grouped
+        
+        try:
+            results = self._query(query_embedding, doc_ids, top_k_per_doc * len(doc_ids))
+        except Exception as e:
+            print(f"✗ Search error: {e}")
+            return grouped
+        
+        chunks = self._format_results(results)
+        chunks.sort(key=lambda x: -x['confidence'])
+        for chunk in chunks:
+            bucket = grouped.get(chunk["doc_id"])
+            if bucket is not None and len(bucket) < top_k_per_doc:
+                bucket.append(chunk)
+        
+        print(f"✓ Found {sum(len(v) for v in grouped.values())} relevant chunks across {len(doc_ids)} documents")
+        return grouped
+    
+    def _indexed(self, doc_ids: Optional[List[str]]) -> bool:
+        """Whether the in-memory index can answer a search over these documents"""
+        if doc_ids:
+            return all(doc_id in self.index for doc_id in doc_ids)
+        return len(self.index) > 0
+    
+    def _from_index_hit(self, hit: Dict) -> Dict:
+        """Convert an index hit into the chunk dict returned by searches"""
+        # Vectors are unit length, so 1 - inner product is the cosine distance
+        distance = 1.0 - hit.pop("score")
+        hit["confidence"] = float(max(0.0, min(1.0, 1.0 - (distance / 2.0))))
+        hit["raw_distance"] = float(distance)
+        return hit
+    
+    def _query(self, query_embedding: np.ndarray, doc_ids: Optional[List[str]], top_k: int) -> Dict:
+        """Run a vector query, clamping n_results to the number of stored chunks"""
+        where_filter = {"doc_id": {"$in": list(doc_ids)}} if doc_ids else None
+        
+        # Chunk counts are tracked on write, so no metadata probe is needed
+        if doc_ids:
+            available_count = sum(self._doc_chunk_counts.get(doc_id, 0) for doc_id in doc_ids)
+        else:
+            available_count = sum(self._doc_chunk_counts.values())
+        n_results = min(top_k, available_count or top_k)
+        
+        # Suppress individual operation telemetry
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return self.collection.query(
+                query_embeddings=_chroma_embeddings(query_embedding[None, :]),
+                n_results=n_results,
+                where=where_filter
+            )
+    
+    def _format_results(self, results: Dict) -> List[Dict]:
+        """Convert a Chroma query result into chunk dicts"""
         chunks = []
         if results['documents'] and results['documents'][0]:
             for i, doc in enumerate(results['documents'][0]):
                 metadata = results['metadatas'][0][i]
                 distance = results['distances'][0][i]
                 
-                page_num = int(metadata.get("page_number", 1))
                 confidence = max(0.0, min(1.0, 1.0 - (distance / 2.0)))
                 
                 chunks.append({
                     "text": doc,
                     "doc_id": metadata["doc_id"],
-                    "chunk_id": int(metadata["chunk_id"]),
-                    "page_number": page_num,
+                    "chunk_id": metadata["chunk_id"],
+                    "page_number": metadata.get("page_number", 1),
                     "confidence": float(confidence),
                     "raw_distance": float(distance)
                 })
-        
-        chunks.sort(key=lambda x: -x['confidence'])
         return chunks
     
     def delete_document(self, doc_id: str):
@@ -166,9 +396,9 @@ class EmbeddingService:
         try:
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
-                results = self.collection.get(where={"doc_id": doc_id})
-                if results.get('ids'):
-                    self.collection.delete(ids=results['ids'])
-                    print(f"✓ Deleted document {doc_id[:8]}")
+                self.index.remove(doc_id)
+                self._doc_chunk_counts.pop(doc_id, None)
+                self.collection.delete(where={"doc_id": doc_id})
+                print(f"✓ Deleted document {doc_id[:8]}")
         except Exception as e:
             print(f"✗ Delete error: {e}")
\ No newline at end of file
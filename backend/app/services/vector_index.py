@@ -0,0 +1,109 @@
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.services.vector_kernels import topk_ip
+
+# FAISS is optional; without it search falls back to an exact float32 numpy matmul
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row so inner product equals cosine similarity"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / (norms + 1e-12)
+
+
+class _DocEntry:
+    __slots__ = ("index", "vectors", "texts", "chunk_ids", "page_numbers")
+
+    def __init__(self, vectors: np.ndarray, texts: List[str], chunk_ids: List[int], page_numbers: List[int]):
+        self.texts = texts
+        self.chunk_ids = chunk_ids
+        self.page_numbers = page_numbers
+        if faiss is not None:
+            # 8-bit scalar quantization: 4x less memory traffic than float32,
+            # queries stay float32 and are compared against decoded codes
+            self.index = faiss.IndexScalarQuantizer(
+                vectors.shape[1], faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+            self.index.train(vectors)
+            self.index.add(vectors)
+            self.vectors = None
+        else:
+            self.index = None
+            # Kept as float32: both the Numba kernel and numpy's BLAS matmul need it
+            self.vectors = vectors
+
+    def __len__(self):
+        return len(self.texts)
+
+    def search(self, query: np.ndarray, top_k: int):
+        """Return (scores, positions) of the top_k chunks, best first"""
+        top_k = min(top_k, len(self))
+        if self.index is not None:
+            scores, positions = self.index.search(query[None, :], top_k)
+            return scores[0], positions[0]
+
+        return topk_ip(self.vectors, query, top_k)
+
+
+class VectorIndex:
+    """In-memory inner-product index over per-document chunk embeddings
+
+    With FAISS, vectors are stored 8-bit scalar-quantized, so scores are
+    approximate; without it they are exact float32 inner products. Vectors
+    and queries must already be L2-normalized (see normalize_rows), so the
+    inner product is the cosine similarity.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._docs: Dict[str, _DocEntry] = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id: str, vectors: np.ndarray, texts: List[str],
+            chunk_ids: List[int], page_numbers: List[int]):
+        """Index a document's unit-length chunk embeddings, replacing any previous entry"""
+        entry = _DocEntry(np.ascontiguousarray(vectors, dtype=np.float32), texts, chunk_ids, page_numbers)
+        with self._lock:
+            self._docs[doc_id] = entry
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self._docs.pop(doc_id, None)
+
+    def search(self, query: np.ndarray, doc_ids: Optional[List[str]] = None, top_k: int = 10) -> List[Dict]:
+        """Return the top_k chunks across the given documents, best first"""
+        query = np.ascontiguousarray(query, dtype=np.float32)
+        with self._lock:
+            targets = [(d, self._docs[d]) for d in (doc_ids or list(self._docs)) if d in self._docs]
+
+        hits = []
+        for doc_id, entry in targets:
+            scores, positions = entry.search(query, top_k)
+            for score, pos in zip(scores, positions):
+                hits.append((float(score), doc_id, entry, int(pos)))
+
+        hits.sort(key=lambda h: -h[0])
+        return [
+            {
+                "text": entry.texts[pos],
+                "doc_id": doc_id,
+                "chunk_id": entry.chunk_ids[pos],
+                "page_number": entry.page_numbers[pos],
+                "score": score
+            }
+            for score, doc_id, entry, pos in hits[:top_k]
+        ]
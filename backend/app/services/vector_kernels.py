@@ -0,0 +1,39 @@
+from typing import Tuple
+
+import numpy as np
+
+# Numba is optional; without it scoring is a plain numpy matrix-vector product
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+HAVE_NUMBA = njit is not None
+
+if HAVE_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _scores_ip(mat, q):
+        n, d = mat.shape
+        scores = np.empty(n, np.float32)
+        for i in prange(n):
+            s = np.float32(0.0)
+            for j in range(d):
+                s += mat[i, j] * q[j]
+            scores[i] = s
+        return scores
+
+
+def topk_ip(mat: np.ndarray, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (scores, positions) of the k rows of mat with the largest inner product with q"""
+    if HAVE_NUMBA and mat.dtype == np.float32:
+        scores = _scores_ip(mat, q.astype(np.float32))
+    else:
+        scores = (mat @ q.astype(mat.dtype)).astype(np.float32)
+
+    k = min(k, len(scores))
+    if k < len(scores):
+        positions = np.argpartition(-scores, k - 1)[:k]
+    else:
+        positions = np.arange(len(scores))
+    positions = positions[np.argsort(-scores[positions])]
+    return scores[positions], positions
@@ -11,8 +11,21 @@ os.environ['ANONYMIZED_TELEMETRY'] = 'False'
 logging.getLogger('chromadb').setLevel(logging.ERROR)
 logging.getLogger('chromadb.telemetry').setLevel(logging.ERROR)
 
+logger = logging.getLogger(__name__)
+
+# Set once the patch has been applied, so re-imports and repeat calls are no-ops
+_PATCHED = False
+
+def _report_failure(e: Exception):
+    if os.environ.get("QA_DEBUG"):
+        print(f"Could not patch telemetry: {e}")
+
 def patch_chromadb_telemetry():
     """Completely disable ChromaDB telemetry"""
+    global _PATCHED
+    if _PATCHED:
+        return
+    
     try:
         # Try to patch the telemetry module
         import chromadb.telemetry.posthog as posthog_module
@@ -24,7 +37,8 @@ def patch_chromadb_telemetry():
         # Replace the capture method
         if hasattr(posthog_module, 'Posthog'):
             posthog_module.Posthog.capture = dummy_capture
-            print("✓ ChromaDB telemetry disabled")
+            _PATCHED = True
+            logger.debug("ChromaDB telemetry disabled")
         
     except ImportError:
         # If the module structure is different, try alternative approaches
@@ -41,13 +55,14 @@ def patch_chromadb_telemetry():
             
             if hasattr(telemetry, 'posthog'):
                 telemetry.posthog.Posthog = DummyTelemetry
-                print("✓ ChromaDB telemetry disabled (alternative method)")
+                _PATCHED = True
+                logger.debug("ChromaDB telemetry disabled (alternative method)")
                 
         except Exception as e:
-            print(f"Could not patch telemetry: {e}")
+            _report_failure(e)
     
     except Exception as e:
-        print(f"Could not patch telemetry: {e}")
+        _report_failure(e)
 
 # Apply patch immediately when imported
 patch_chromadb_telemetry()
\ No newline at end of file
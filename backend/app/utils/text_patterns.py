@@ -0,0 +1,81 @@
+"""
+Shared tokenizing helpers for the document, citation and QA services
+"""
+import re
+from functools import lru_cache
+from typing import List
+
+# tiktoken is optional; without it token counts use the ~4 chars/token heuristic
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+# google-re2 is optional; its DFA matcher is a drop-in for this regular pattern
+try:
+    import re2 as _regex_engine
+except ImportError:
+    _regex_engine = re
+
+class _NonWordTable(dict):
+    """str.translate table mapping every non-\\w character to a space
+
+    Filled lazily: the first time a code point is seen, __missing__ decides
+    it the way re's \\w does (str.isalnum() or '_'), and every later lookup
+    is a plain dict hit in C. Curly quotes, dashes and bullets from PDF and
+    Gemini text therefore split words just like ASCII punctuation does.
+    """
+
+    def __missing__(self, code: int) -> int:
+        char = chr(code)
+        value = code if char.isalnum() or char == '_' else 32
+        self[code] = value
+        return value
+
+# str.translate + str.split with this table tokenizes exactly like
+# re.findall(r'\b\w+\b') at C speed
+PUNCT_TABLE = _NonWordTable()
+
+# Runs of sentence-ending punctuation
+SENTENCE_END_RE = _regex_engine.compile(r'[.!?]+')
+
+_SENTENCE_END_TABLE = str.maketrans('!?', '..')
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens of text"""
+    return text.lower().translate(PUNCT_TABLE).split()
+
+def split_sentences(text: str) -> List[str]:
+    """Split on . ! ? -- like SENTENCE_END_RE.split, plus empty pieces between repeats"""
+    return text.translate(_SENTENCE_END_TABLE).split('.')
+
+def count_sentences(text: str) -> int:
+    """Number of pieces SENTENCE_END_RE.split(text) would produce"""
+    return len(SENTENCE_END_RE.findall(text)) + 1
+
+@lru_cache(maxsize=8192)
+def token_len(text: str) -> int:
+    """Approximate prompt token count of text"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Cut text to at most `budget` tokens, marking the cut with an ellipsis"""
+    if token_len(text) <= budget:
+        return text
+    if _ENCODING is not None:
+        return _ENCODING.decode(_ENCODING.encode(text, disallowed_special=())[:budget]) + "..."
+    return text[:budget * 4] + "..."
+
+def split_token_budget(lengths: List[int], budget: int) -> List[int]:
+    """Share a token budget across texts: short ones keep their length, the rest split what is left"""
+    shares = [0] * len(lengths)
+    remaining = budget
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    for n, i in enumerate(order):
+        fair = remaining // (len(order) - n)
+        shares[i] = min(lengths[i], fair)
+        remaining -= shares[i]
+    return shares